@@ -0,0 +1,176 @@
+"""Admission control and load shedding for council runs.
+
+At most MAX_ACTIVE_COUNCILS councils run at once in this worker. Further
+requests wait in a bounded queue that is served round-robin across clients, so
+one busy client cannot starve the others. When the queue (or a client's share
+of it) is full, requests are rejected immediately with a Retry-After estimate
+instead of piling more load onto the providers.
+"""
+
+import asyncio
+import ipaddress
+import math
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from config import MAX_ACTIVE_COUNCILS, MAX_QUEUED_COUNCILS, MAX_QUEUED_PER_CLIENT, TRUSTED_PROXIES
+
+_trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in TRUSTED_PROXIES]
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_proxies)
+
+
+def client_key(peer: str, forwarded_for: Optional[str]) -> str:
+    """Fair-share identity of a request: the IP address it came from.
+
+    Behind a trusted proxy this is the nearest X-Forwarded-For hop that is not itself a
+    trusted proxy. Hops further left were written by the client and are ignored, so
+    forging them cannot get around the per-client queue limit.
+    """
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()] + [peer]
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0]
+
+
+class Ticket:
+    def __init__(self, client: str):
+        self.client = client
+        self.granted = asyncio.get_running_loop().create_future()
+        self.started_at: Optional[float] = None
+        self.released = False
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Council queue is full; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_active: int, max_queued: int, max_queued_per_client: int):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.active = 0
+        self.rejected = 0
+        self.avg_duration = 60.0  # seconds per council, smoothed; seeds the Retry-After estimate
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()  # rotation order: front is served next
+        self._changed = asyncio.Event()
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_duration * (self.queued() + 1) / self.max_active))
+
+    def enqueue(self, client: str) -> Ticket:
+        """Admit or queue a request, raising QueueFull if it has to be shed."""
+        ticket = Ticket(client)
+        if self.active < self.max_active and not self._queues:
+            self._grant(ticket)
+            return ticket
+        if self.queued() >= self.max_queued or len(self._queues.get(client, ())) >= self.max_queued_per_client:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+        self._queues.setdefault(client, deque()).append(ticket)
+        self._notify()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based place in line under round-robin service, or 0 once admitted."""
+        if ticket.granted.done():
+            return 0
+        clients = list(self._queues)
+        own = self._queues[ticket.client]
+        index = own.index(ticket)
+        ahead = index
+        for order, client in enumerate(clients):
+            if client != ticket.client:
+                served_first = order < clients.index(ticket.client)
+                ahead += min(len(self._queues[client]), index + (1 if served_first else 0))
+        return ahead + 1
+
+    async def wait(self, ticket: Ticket) -> AsyncIterator[int]:
+        """Yield the ticket's queue position each time it changes, until it is admitted."""
+        last = None
+        while not ticket.granted.done():
+            # Taken before reading the position, so a change made while the caller handles the yield is not missed.
+            changed = self._changed
+            position = self.position(ticket)
+            if position != last:
+                last = position
+                yield position
+            waiter = asyncio.ensure_future(changed.wait())
+            try:
+                await asyncio.wait({ticket.granted, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+    def release(self, ticket: Optional[Ticket]):
+        """Free the ticket's slot, or drop it from the queue if it never got one. Idempotent; never awaits."""
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        if ticket.started_at is not None:
+            self.active -= 1
+            duration = time.monotonic() - ticket.started_at
+            self.avg_duration = 0.9 * self.avg_duration + 0.1 * duration
+            self._admit_next()
+        else:
+            queue = self._queues.get(ticket.client)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.client]
+            ticket.granted.cancel()
+        self._notify()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "queued": self.queued(),
+            "max_queued": self.max_queued,
+            "clients_waiting": len(self._queues),
+            "rejected": self.rejected,
+            "avg_duration": self.avg_duration,
+        }
+
+    def _grant(self, ticket: Ticket):
+        self.active += 1
+        ticket.started_at = time.monotonic()
+        ticket.granted.set_result(True)
+
+    def _admit_next(self):
+        while self.active < self.max_active and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # Rotate: the client just served goes to the back of the line.
+            del self._queues[client]
+            if queue:
+                self._queues[client] = queue
+            self._grant(ticket)
+
+    def _notify(self):
+        # Wake every waiter on the current event and start a fresh one; waiters never clear it themselves.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(MAX_ACTIVE_COUNCILS, MAX_QUEUED_COUNCILS, MAX_QUEUED_PER_CLIENT)
+    return _controller
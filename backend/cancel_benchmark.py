@@ -0,0 +1,104 @@
+"""Load test for cancelling council runs.
+
+Starts many councils at once against a stub provider (every call sleeps for
+--call-latency seconds), lets them reach stage 2, then stops every caller
+through the cancel endpoint and measures how long each stream takes to close.
+With --callers above 1, each question is asked by that many conversations at
+once, so the callers share one single-flight run and the run must only be
+cancelled once the last of them has gone.
+
+The test fails (exit status 1) if any provider call is still in flight after
+the streams have closed. It runs against a throwaway SQLite database, never the
+configured one.
+
+Usage:
+    python cancel_benchmark.py [--councils 200] [--callers 1] [--cancel-after 7] [--call-latency 5]
+"""
+
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cancel_benchmark.db')}"
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+from starlette.requests import Request
+
+import admission
+import llm_clients
+import main as api
+import storage
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+async def run_benchmark(councils: int, callers: int, cancel_after: float, call_latency: float) -> Dict[str, Any]:
+    calls = {"in_flight": 0, "aborted": 0, "completed": 0}
+
+    async def stub_dispatch(provider, model_id, messages, timeout, max_tokens):
+        calls["in_flight"] += 1
+        try:
+            await asyncio.sleep(call_latency)
+            calls["completed"] += 1
+            return {'content': "FINAL RANKING:\n1. Response A", 'usage': {'prompt_tokens': 10, 'completion_tokens': 5}}
+        except asyncio.CancelledError:
+            calls["aborted"] += 1
+            raise
+        finally:
+            calls["in_flight"] -= 1
+
+    llm_clients._dispatch = stub_dispatch
+    total = councils * callers
+    admission._controller = admission.AdmissionController(total, 0, 0)
+
+    async def caller(council: int, index: int) -> float:
+        conversation_id = f"bench-{council}-{index}"
+        storage.create_conversation(conversation_id)
+        request = Request({"type": "http", "headers": [], "client": (f"client-{council}-{index}", 0)})
+        response = await api.send_message_stream(conversation_id, api.SendMessageRequest(content=f"question {council}"), request)
+
+        async def consume():
+            async for chunk in response.body_iterator:
+                json.loads(chunk[len("data: "):])
+
+        stream = asyncio.create_task(consume())
+        await asyncio.sleep(cancel_after)
+        cancelled_at = time.perf_counter()
+        await api.cancel_message_stream(conversation_id)
+        await stream
+        return time.perf_counter() - cancelled_at
+
+    latencies = await asyncio.gather(*(caller(c, i) for c in range(councils) for i in range(callers)))
+    # Let the cancelled runs unwind their provider tasks.
+    await asyncio.sleep(0.1)
+    return {"streams": total, "latencies": latencies, **calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how quickly stopped council runs close and abort their provider calls.")
+    parser.add_argument("--councils", type=int, default=200)
+    parser.add_argument("--callers", type=int, default=1, help="conversations asking each question at once")
+    parser.add_argument("--cancel-after", type=float, default=7.0, help="seconds before stopping (default lands in stage 2)")
+    parser.add_argument("--call-latency", type=float, default=5.0, help="seconds each stub provider call takes")
+    args = parser.parse_args()
+
+    storage.init_db()
+    result = asyncio.run(run_benchmark(args.councils, args.callers, args.cancel_after, args.call_latency))
+    latencies = result["latencies"]
+    print(f"streams closed:       {result['streams']}")
+    print(f"cancel latency (ms):  p50 {_percentile(latencies, 50) * 1000:.1f}  p99 {_percentile(latencies, 99) * 1000:.1f}  max {max(latencies) * 1000:.1f}")
+    print(f"provider calls:       {result['completed']} completed, {result['aborted']} aborted, {result['in_flight']} still in flight")
+    if result["in_flight"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
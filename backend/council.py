@@ -1,8 +1,15 @@
 """3-stage LLM Council orchestration for The Board Room - XMARCS."""
 
-from typing import List, Dict, Any, Tuple
-from llm_clients import query_models_parallel, query_model
-from config import COUNCIL_MODELS, CHAIRMAN_MODEL
+import asyncio
+import math
+import random
+import re
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple, AsyncIterator
+from llm_clients import query_models_parallel, query_model, tracing
+from config import COUNCIL_MODELS, CHAIRMAN_MODEL, COUNCIL_QUORUM, TITLE_MODEL, REVIEWER_MODELS, PRESUMMARIZER_MODEL, REVIEW_SAMPLE_SIZE
+
+BRADLEY_TERRY_ITERATIONS = 100
 
 
 # THE BOARD ROOM EXECUTION STANDARD
@@ -128,12 +135,13 @@ Deliver your synthesis with the authority of a board chairman addressing a fello
 
 async def stage1_collect_responses(user_query: str) -> List[Dict[str, Any]]:
     """Stage 1: Collect individual responses from all council models."""
+    tracing.current_stage.set("stage1")
     messages = [
         {"role": "system", "content": COUNCIL_SYSTEM_PROMPT},
         {"role": "user", "content": user_query}
     ]
 
-    responses = await query_models_parallel(COUNCIL_MODELS, messages)
+    responses = await query_models_parallel(COUNCIL_MODELS, messages, quorum=COUNCIL_QUORUM)
 
     stage1_results = []
     for model_config in COUNCIL_MODELS:
@@ -142,6 +150,8 @@ async def stage1_collect_responses(user_query: str) -> List[Dict[str, Any]]:
         if response is not None:
             stage1_results.append({
                 "model": model_name,
+                "model_id": response.get('model_id', model_config['model_id']),
+                "fallback": response.get('model_id', model_config['model_id']) != model_config['model_id'],
                 "response": response.get('content', ''),
                 "usage": response.get('usage', {})
             })
@@ -149,20 +159,105 @@ async def stage1_collect_responses(user_query: str) -> List[Dict[str, Any]]:
     return stage1_results
 
 
+async def presummarize_responses(stage1_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Condense stage-1 answers with PRESUMMARIZER_MODEL so stages 2 and 3 get shorter prompts.
+
+    Adds a "summary" to each result; answers that fail to summarize keep their full text.
+    """
+    if PRESUMMARIZER_MODEL is None:
+        return stage1_results
+    tracing.current_stage.set("presummary")
+
+    async def summarize(result: Dict[str, Any]):
+        summary_prompt = f"""Condense this advisor response to its direct answer, key claims, evidence and recommendations. Keep every concrete number and recommendation. No preamble.
+
+RESPONSE:
+{result['response']}"""
+        response = await query_model(PRESUMMARIZER_MODEL['provider'], PRESUMMARIZER_MODEL['model_id'], [{"role": "user", "content": summary_prompt}])
+        if response is not None and response.get('content'):
+            result['summary'] = response['content']
+
+    await asyncio.gather(*(summarize(result) for result in stage1_results))
+    return stage1_results
+
+
+def _response_text(result: Dict[str, Any]) -> str:
+    return result.get('summary') or result['response']
+
+
+def _answered_by(result: Dict[str, Any]) -> str:
+    """Name to credit for a stage-1 or stage-2 result, naming the fallback model if a hedge answered for the member."""
+    return f"{result['model']} ({result['model_id']})" if result.get('fallback') else result['model']
+
+
+def _label(index: int) -> str:
+    """Spreadsheet-style labels: A..Z, then AA, AB, ..."""
+    label = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(65 + remainder) + label
+    return label
+
+
+def assign_reviews(reviewers: List[str], labels: List[str], authors: Dict[str, str]) -> Dict[str, List[str]]:
+    """Choose the answers each reviewer ranks.
+
+    Councils no larger than REVIEW_SAMPLE_SIZE review every answer. Larger ones are
+    sampled: each reviewer ranks enough answers (never its own) for every answer to be
+    ranked at least REVIEW_SAMPLE_SIZE times, or by every reviewer if there are fewer.
+    Reviewers take the least-reviewed answers so far, ties broken at random, and
+    coverage is then levelled so no two answers differ by more than one review.
+    """
+    if REVIEW_SAMPLE_SIZE is None or len(labels) <= REVIEW_SAMPLE_SIZE:
+        return {reviewer: list(labels) for reviewer in reviewers}
+    if not reviewers:
+        return {}
+    size = max(REVIEW_SAMPLE_SIZE, math.ceil(len(labels) * REVIEW_SAMPLE_SIZE / len(reviewers)))
+    reviews = {label: 0 for label in labels}
+    assignment = {}
+    for reviewer in random.sample(reviewers, len(reviewers)):
+        eligible = [label for label in labels if authors[label] != reviewer]
+        random.shuffle(eligible)
+        eligible.sort(key=reviews.get)
+        shown = eligible[:size]
+        for label in shown:
+            reviews[label] += 1
+        assignment[reviewer] = shown
+    # Greedy picks can strand an answer whose author came last; move reviews over until coverage is level.
+    while True:
+        fewest = min(labels, key=reviews.get)
+        most = max(labels, key=reviews.get)
+        if reviews[most] - reviews[fewest] <= 1:
+            break
+        reviewer = next(r for r, shown in assignment.items() if most in shown and fewest not in shown and authors[fewest] != r)
+        assignment[reviewer][assignment[reviewer].index(most)] = fewest
+        reviews[most] -= 1
+        reviews[fewest] += 1
+    for shown in assignment.values():
+        random.shuffle(shown)
+    return assignment
+
+
 async def stage2_collect_rankings(
     user_query: str,
     stage1_results: List[Dict[str, Any]]
 ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
-    """Stage 2: Each model ranks the anonymized responses."""
-    labels = [chr(65 + i) for i in range(len(stage1_results))]
-    label_to_model = {f"Response {label}": result['model'] for label, result in zip(labels, stage1_results)}
-
-    responses_text = "\n\n".join([
-        f"Response {label}:\n{result['response']}"
-        for label, result in zip(labels, stage1_results)
-    ])
-
-    ranking_prompt = f"""PEER EVALUATION REQUEST
+    """Stage 2: Each model ranks a sample of the anonymized responses."""
+    tracing.current_stage.set("stage2")
+    labels = [_label(i) for i in range(len(stage1_results))]
+    label_to_model = {f"Response {label}": _answered_by(result) for label, result in zip(labels, stage1_results)}
+    texts = {label: _response_text(result) for label, result in zip(labels, stage1_results)}
+    authors = {label: result['model'] for label, result in zip(labels, stage1_results)}
+
+    reviewers = REVIEWER_MODELS or COUNCIL_MODELS
+    assignment = assign_reviews([model_config['name'] for model_config in reviewers], labels, authors)
+
+    messages = {}
+    for reviewer, shown in assignment.items():
+        responses_text = "\n\n".join([f"Response {label}:\n{texts[label]}" for label in shown])
+        ranking_template = "\n".join(f"{position}. Response X" for position in range(1, len(shown) + 1))
+        ranking_prompt = f"""PEER EVALUATION REQUEST
 
 Evaluate these responses from your fellow council members.
 
@@ -195,25 +290,27 @@ REWARD responses that:
 Provide brief evaluation notes, then your ranking.
 
 FINAL RANKING:
-1. Response X
-2. Response X
-3. Response X
-4. Response X"""
+{ranking_template}"""
+        messages[reviewer] = [{"role": "user", "content": ranking_prompt}]
 
-    messages = [{"role": "user", "content": ranking_prompt}]
-    responses = await query_models_parallel(COUNCIL_MODELS, messages)
+    responses = await query_models_parallel(reviewers, messages, quorum=COUNCIL_QUORUM)
 
     stage2_results = []
-    for model_config in COUNCIL_MODELS:
+    for model_config in reviewers:
         model_name = model_config['name']
         response = responses.get(model_name)
         if response is not None:
             full_text = response.get('content', '')
-            parsed = parse_ranking_from_text(full_text)
+            shown = [f"Response {label}" for label in assignment[model_name]]
+            parsed = [label for label in parse_ranking_from_text(full_text) if label in shown]
             stage2_results.append({
                 "model": model_name,
+                "model_id": response.get('model_id', model_config['model_id']),
+                "fallback": response.get('model_id', model_config['model_id']) != model_config['model_id'],
                 "ranking": full_text,
-                "parsed_ranking": parsed
+                "parsed_ranking": parsed,
+                "shown": shown,
+                "usage": response.get('usage', {})
             })
 
     return stage2_results, label_to_model
@@ -225,13 +322,14 @@ async def stage3_synthesize_final(
     stage2_results: List[Dict[str, Any]]
 ) -> str:
     """Stage 3: Chairman synthesizes final response."""
+    tracing.current_stage.set("stage3")
     stage1_text = "\n\n".join([
-        f"Model: {result['model']}\nResponse: {result['response']}"
+        f"Model: {_answered_by(result)}\nResponse: {_response_text(result)}"
         for result in stage1_results
     ])
 
     stage2_text = "\n\n".join([
-        f"Model: {result['model']}\nRanking: {result['ranking']}"
+        f"Model: {_answered_by(result)}\nRanking: {result['ranking']}"
         for result in stage2_results
     ])
 
@@ -291,49 +389,65 @@ Deliver your synthesis:"""
 
 def parse_ranking_from_text(ranking_text: str) -> List[str]:
     """Parse FINAL RANKING section from model response."""
-    import re
-
     if "FINAL RANKING:" in ranking_text:
         parts = ranking_text.split("FINAL RANKING:")
         if len(parts) >= 2:
             ranking_section = parts[1]
-            numbered_matches = re.findall(r'\d+\.\s*Response [A-D]', ranking_section)
+            numbered_matches = re.findall(r'\d+\.\s*Response [A-Z]+\b', ranking_section)
             if numbered_matches:
-                return [re.search(r'Response [A-D]', m).group() for m in numbered_matches]
-            matches = re.findall(r'Response [A-D]', ranking_section)
+                return [re.search(r'Response [A-Z]+', m).group() for m in numbered_matches]
+            matches = re.findall(r'Response [A-Z]+\b', ranking_section)
             return matches
 
-    return re.findall(r'Response [A-D]', ranking_text)
+    return re.findall(r'Response [A-Z]+\b', ranking_text)
 
 
 def calculate_aggregate_rankings(
     stage2_results: List[Dict[str, Any]],
     label_to_model: Dict[str, str]
 ) -> Dict[str, float]:
-    """Calculate aggregate rankings across all models."""
-    from collections import defaultdict
-
-    model_positions = defaultdict(list)
-
+    """Aggregate the reviewers' partial rankings with a Bradley-Terry model.
+
+    Each ranking counts as a win for every answer over each answer placed below it.
+    Strengths are fit with the MM algorithm, plus one virtual win and loss per answer
+    against an average opponent so answers that always win or always lose stay finite.
+    Scores are expected positions among all ranked answers (1 = best, lower is better).
+    """
+    wins = defaultdict(lambda: defaultdict(float))
+    models = set()
     for ranking in stage2_results:
-        ranking_text = ranking['ranking']
-        parsed_ranking = parse_ranking_from_text(ranking_text)
-
-        for position, label in enumerate(parsed_ranking, start=1):
-            if label in label_to_model:
-                model_name = label_to_model[label]
-                model_positions[model_name].append(position)
-
-    aggregate = {}
-    for model, positions in model_positions.items():
-        if positions:
-            aggregate[model] = sum(positions) / len(positions)
-
-    return aggregate
+        shown = ranking.get('shown') or list(label_to_model)
+        ordered = [label for label in dict.fromkeys(ranking['parsed_ranking']) if label in shown and label in label_to_model]
+        for position, label in enumerate(ordered):
+            models.add(label_to_model[label])
+            for worse in ordered[position + 1:]:
+                wins[label_to_model[label]][label_to_model[worse]] += 1
+    if not models:
+        return {}
+
+    strength = {model: 1.0 for model in models}
+    for _ in range(BRADLEY_TERRY_ITERATIONS):
+        updated = {}
+        for model in models:
+            won = sum(wins[model].values()) + 1
+            rate = 2 / (strength[model] + 1)
+            for other in models:
+                games = wins[model][other] + wins[other][model]
+                if other != model and games:
+                    rate += games / (strength[model] + strength[other])
+            updated[model] = won / rate
+        scale = math.exp(sum(math.log(value) for value in updated.values()) / len(updated))
+        strength = {model: value / scale for model, value in updated.items()}
+
+    return {
+        model: 1 + sum(strength[other] / (strength[model] + strength[other]) for other in models if other != model)
+        for model in models
+    }
 
 
 async def generate_conversation_title(user_query: str) -> str:
     """Generate a short title for a conversation."""
+    tracing.current_stage.set("title")
     title_prompt = f"""Generate a very short title (3-5 words maximum) for this question. No quotes or punctuation.
 
 Question: {user_query}
@@ -341,7 +455,7 @@ Question: {user_query}
 Title:"""
 
     messages = [{"role": "user", "content": title_prompt}]
-    response = await query_model("google", "gemini-2.0-flash-exp", messages, timeout=30.0)
+    response = await query_model(TITLE_MODEL['provider'], TITLE_MODEL['model_id'], messages)
 
     if response is None:
         return "New Conversation"
@@ -350,21 +464,37 @@ Title:"""
     return title[:50] if len(title) > 50 else title
 
 
-async def run_full_council(user_query: str) -> Tuple[List, List, str, Dict]:
-    """Run the complete 3-stage council process."""
+async def stream_council(user_query: str) -> AsyncIterator[Dict[str, Any]]:
+    """Run the 3-stage council, yielding progress events as each stage completes."""
+    tracing.begin_run()
+    yield {'type': 'stage1_start'}
     stage1_results = await stage1_collect_responses(user_query)
-
     if not stage1_results:
-        return [], [], "Error: All models failed to respond.", {}
+        yield {'type': 'error', 'message': 'All models failed to respond.'}
+        return
+    yield {'type': 'stage1_complete', 'data': stage1_results}
 
+    yield {'type': 'stage2_start'}
+    await presummarize_responses(stage1_results)
     stage2_results, label_to_model = await stage2_collect_rankings(user_query, stage1_results)
     aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
+    yield {'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}}
 
+    yield {'type': 'stage3_start'}
     stage3_result = await stage3_synthesize_final(user_query, stage1_results, stage2_results)
+    yield {'type': 'stage3_complete', 'data': stage3_result}
 
-    metadata = {
-        "label_to_model": label_to_model,
-        "aggregate_rankings": aggregate_rankings
-    }
 
-    return stage1_results, stage2_results, stage3_result, metadata
+async def run_full_council(user_query: str) -> Tuple[List, List, str, Dict]:
+    """Run the complete 3-stage council process, through the same orchestration as stream_council."""
+    events = {}
+    async for event in stream_council(user_query):
+        if event['type'] == 'error':
+            return [], [], f"Error: {event['message']}", {}
+        events[event['type']] = event
+    return (
+        events['stage1_complete']['data'],
+        events['stage2_complete']['data'],
+        events['stage3_complete']['data'],
+        events['stage2_complete']['metadata'],
+    )
@@ -1,50 +1,146 @@
 """LLM client modules for The Board Room."""
 
 import asyncio
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Union
 
 from .anthropic_client import query_claude
 from .openai_client import query_gpt
 from .google_client import query_gemini
 from .xai_client import query_grok
 from .zhipu_client import query_glm
+from .local_client import query_local
+from . import tracing
+from .latency import tracker
+from .hedging import policy as hedge_policy
+from config import STAGE_OUTPUT_TOKENS
 
 
 async def query_model(
     provider: str,
     model_id: str,
     messages: List[Dict[str, str]],
-    timeout: float = 180.0
+    timeout: Optional[float] = None,
+    max_tokens: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """Query a single model, recording the call to the trace log.
+
+    Unless given, the timeout is learned from the provider's recent latencies and the
+    output budget comes from STAGE_OUTPUT_TOKENS, both for the current council stage.
+    Slow calls may be hedged with a backup request (see hedging); the result's
+    "model_id" names the model that actually answered.
+    """
+    stage = tracing.current_stage.get()
+    delay = hedge_policy.delay_for(provider, stage)
+    if delay is None:
+        return await _query_once(provider, model_id, messages, timeout, max_tokens)
+
+    started = time.time()
+    primary = asyncio.ensure_future(_query_once(provider, model_id, messages, timeout, max_tokens))
+    backup = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not hedge_policy.try_hedge():
+            return await primary
+        backup_provider, backup_model_id = hedge_policy.backup_for(provider, model_id)
+        backup = asyncio.ensure_future(_query_once(backup_provider, backup_model_id, messages, timeout, max_tokens))
+        pending = {primary, backup}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result() is not None:
+                    if task is backup:
+                        hedge_policy.record_win(provider, stage, time.time() - started)
+                    return task.result()
+        return None
+    finally:
+        primary.cancel()
+        if backup is not None:
+            backup.cancel()
+
+
+async def _query_once(
+    provider: str,
+    model_id: str,
+    messages: List[Dict[str, str]],
+    timeout: Optional[float],
+    max_tokens: Optional[int]
+) -> Optional[Dict[str, Any]]:
+    stage = tracing.current_stage.get()
+    timeout = timeout or tracker.timeout_for(provider, stage)
+    max_tokens = max_tokens or STAGE_OUTPUT_TOKENS.get(stage)
+    started = time.time()
+    tracing.reset_error()
+    try:
+        result = await _dispatch(provider, model_id, messages, timeout, max_tokens)
+    except asyncio.CancelledError:
+        tracing.record(provider, model_id, started, time.time() - started, None, error="cancelled")
+        raise
+    latency = time.time() - started
+    if result is not None:
+        # A hedge may be answered by a fallback model; callers read who actually answered from here.
+        result['model_id'] = model_id
+    if result is not None or tracing.last_error() == "timeout":
+        tracker.observe(provider, stage, latency)
+    tracing.record(provider, model_id, started, latency, result)
+    return result
+
+
+async def _dispatch(
+    provider: str,
+    model_id: str,
+    messages: List[Dict[str, str]],
+    timeout: float,
+    max_tokens: Optional[int]
 ) -> Optional[Dict[str, Any]]:
-    """Query a single model."""
     if provider == "anthropic":
-        return await query_claude(model_id, messages, timeout)
+        return await query_claude(model_id, messages, timeout, max_tokens)
     elif provider == "openai":
-        return await query_gpt(model_id, messages, timeout)
+        return await query_gpt(model_id, messages, timeout, max_tokens)
     elif provider == "google":
-        return await query_gemini(model_id, messages, timeout)
+        return await query_gemini(model_id, messages, timeout, max_tokens)
     elif provider == "xai":
-        return await query_grok(model_id, messages, timeout)
+        return await query_grok(model_id, messages, timeout, max_tokens)
     elif provider == "zhipu":
-        return await query_glm(model_id, messages, timeout)
+        return await query_glm(model_id, messages, timeout, max_tokens)
+    elif provider == "local":
+        return await query_local(model_id, messages, timeout, max_tokens)
     else:
         return None
 
 
 async def query_models_parallel(
     models: List[Dict[str, str]],
-    messages: List[Dict[str, str]],
-    timeout: float = 180.0
+    messages: Union[List[Dict[str, str]], Dict[str, List[Dict[str, str]]]],
+    timeout: Optional[float] = None,
+    quorum: Optional[int] = None
 ) -> Dict[str, Dict[str, Any]]:
-    """Query multiple models in parallel."""
-    tasks = []
-    model_names = []
-    
+    """Query multiple models in parallel.
+
+    `messages` is either shared by every model or a dict of per-model messages keyed by model name.
+    With a quorum, return as soon as that many models have answered and cancel the stragglers.
+    """
+    tasks = {}
+
     for model_config in models:
-        task = query_model(model_config['provider'], model_config['model_id'], messages, timeout)
-        tasks.append(task)
-        model_names.append(model_config['name'])
-    
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    return {name: result for name, result in zip(model_names, results) if not isinstance(result, Exception) and result is not None}
+        model_messages = messages[model_config['name']] if isinstance(messages, dict) else messages
+        task = asyncio.ensure_future(query_model(model_config['provider'], model_config['model_id'], model_messages, timeout))
+        tasks[task] = model_config['name']
+
+    if quorum is None:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {name: task.result() for task, name in tasks.items() if task.exception() is None and task.result() is not None}
+
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending and len(results) < quorum:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result() is not None:
+                    results[tasks[task]] = task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return results
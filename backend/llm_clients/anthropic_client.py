@@ -3,11 +3,13 @@
 import httpx
 from typing import List, Dict, Any, Optional
 from config import ANTHROPIC_API_KEY, ANTHROPIC_API_URL
+from .tracing import note_error
 
 MAX_OUTPUT_TOKENS = 16384
 
 
-async def query_claude(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0) -> Optional[Dict[str, Any]]:
+async def query_claude(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0, max_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    max_tokens = min(max_tokens, MAX_OUTPUT_TOKENS) if max_tokens else MAX_OUTPUT_TOKENS
     headers = {"x-api-key": ANTHROPIC_API_KEY, "anthropic-version": "2023-06-01", "Content-Type": "application/json"}
     
     system_msg = None
@@ -18,7 +20,7 @@ async def query_claude(model_id: str, messages: List[Dict[str, str]], timeout: f
         else:
             chat_messages.append(msg)
     
-    payload = {"model": model_id, "max_tokens": MAX_OUTPUT_TOKENS, "messages": chat_messages}
+    payload = {"model": model_id, "max_tokens": max_tokens, "messages": chat_messages}
     if system_msg:
         payload["system"] = system_msg
 
@@ -30,8 +32,9 @@ async def query_claude(model_id: str, messages: List[Dict[str, str]], timeout: f
             usage = data.get('usage', {})
             return {
                 'content': data['content'][0]['text'],
-                'usage': {'prompt_tokens': usage.get('input_tokens', 0), 'completion_tokens': usage.get('output_tokens', 0), 'total_tokens': usage.get('input_tokens', 0) + usage.get('output_tokens', 0), 'max_tokens': MAX_OUTPUT_TOKENS}
+                'usage': {'prompt_tokens': usage.get('input_tokens', 0), 'completion_tokens': usage.get('output_tokens', 0), 'total_tokens': usage.get('input_tokens', 0) + usage.get('output_tokens', 0), 'max_tokens': max_tokens}
             }
     except Exception as e:
+        note_error(e)
         print(f"Error querying Claude {model_id}: {e}")
         return None
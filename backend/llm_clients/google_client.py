@@ -3,16 +3,18 @@
 import httpx
 from typing import List, Dict, Any, Optional
 from config import GOOGLE_API_KEY, GOOGLE_API_URL
+from .tracing import note_error
 
 MAX_OUTPUT_TOKENS = 8192
 
 
-async def query_gemini(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0) -> Optional[Dict[str, Any]]:
+async def query_gemini(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0, max_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    max_tokens = min(max_tokens, MAX_OUTPUT_TOKENS) if max_tokens else MAX_OUTPUT_TOKENS
     gemini_parts = []
     for msg in messages:
         gemini_parts.append({"text": msg["content"]})
 
-    payload = {"contents": [{"parts": gemini_parts}], "generationConfig": {"temperature": 0.3, "maxOutputTokens": MAX_OUTPUT_TOKENS}}
+    payload = {"contents": [{"parts": gemini_parts}], "generationConfig": {"temperature": 0.3, "maxOutputTokens": max_tokens}}
     url = f"{GOOGLE_API_URL}/{model_id}:generateContent?key={GOOGLE_API_KEY}"
 
     try:
@@ -23,8 +25,9 @@ async def query_gemini(model_id: str, messages: List[Dict[str, str]], timeout: f
             usage = data.get('usageMetadata', {})
             return {
                 'content': data['candidates'][0]['content']['parts'][0]['text'],
-                'usage': {'prompt_tokens': usage.get('promptTokenCount', 0), 'completion_tokens': usage.get('candidatesTokenCount', 0), 'total_tokens': usage.get('totalTokenCount', 0), 'max_tokens': MAX_OUTPUT_TOKENS}
+                'usage': {'prompt_tokens': usage.get('promptTokenCount', 0), 'completion_tokens': usage.get('candidatesTokenCount', 0), 'total_tokens': usage.get('totalTokenCount', 0), 'max_tokens': max_tokens}
             }
     except Exception as e:
+        note_error(e)
         print(f"Error querying Gemini {model_id}: {e}")
         return None
@@ -0,0 +1,64 @@
+"""Hedged requests for slow provider calls.
+
+A call that outlasts its provider's HEDGE_QUANTILE latency for the stage gets a
+backup request, to the same model or its HEDGE_FALLBACKS entry; the first answer
+wins and the other request is cancelled. Every eligible call earns
+HEDGE_MAX_FRACTION of a hedge and each hedge spends one, so hedges stay within
+that share of traffic while short bursts of slow calls can still be covered.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from config import HEDGE_ENABLED, HEDGE_QUANTILE, HEDGE_STAGES, HEDGE_MAX_FRACTION, HEDGE_BURST, HEDGE_FALLBACKS
+from .latency import tracker
+
+
+class HedgePolicy:
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.over_budget = 0
+        self._budget = 0.0
+
+    def delay_for(self, provider: str, stage: Optional[str]) -> Optional[float]:
+        """Seconds to wait before hedging this call, or None if it is not hedged."""
+        if not HEDGE_ENABLED or stage not in HEDGE_STAGES:
+            return None
+        self.calls += 1
+        self._budget = min(HEDGE_BURST, self._budget + HEDGE_MAX_FRACTION)
+        return tracker.quantile(provider, stage, HEDGE_QUANTILE)
+
+    def try_hedge(self) -> bool:
+        if self._budget < 1:
+            self.over_budget += 1
+            return False
+        self._budget -= 1
+        self.hedged += 1
+        return True
+
+    def backup_for(self, provider: str, model_id: str) -> Tuple[str, str]:
+        fallback = HEDGE_FALLBACKS.get(model_id)
+        if fallback:
+            return fallback['provider'], fallback['model_id']
+        return provider, model_id
+
+    def record_win(self, provider: str, stage: Optional[str], primary_elapsed: float):
+        """Count a backup that answered first. The cancelled primary took at least
+        `primary_elapsed`, which is observed so its tail stays in the latency window."""
+        self.backup_wins += 1
+        tracker.observe(provider, stage, primary_elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": HEDGE_ENABLED,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "backup_wins": self.backup_wins,
+            "over_budget": self.over_budget,
+            "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+            "win_rate": self.backup_wins / self.hedged if self.hedged else 0.0,
+        }
+
+
+policy = HedgePolicy()
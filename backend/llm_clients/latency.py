@@ -0,0 +1,57 @@
+"""Online latency tracking and learned per-provider timeouts."""
+
+from collections import defaultdict, deque
+from typing import Any, Dict, Optional
+
+from config import (
+    STAGE_TIMEOUTS,
+    DEFAULT_TIMEOUT,
+    TIMEOUT_QUANTILE,
+    TIMEOUT_FACTOR,
+    TIMEOUT_FLOOR,
+    TIMEOUT_MIN_SAMPLES,
+    TIMEOUT_WINDOW,
+)
+
+
+class LatencyTracker:
+    """Sliding window of call latencies per (provider, stage).
+
+    Timed-out calls are observed at the timeout they hit, so a heavy tail pushes
+    the learned timeout up instead of being censored out of the window.
+    """
+
+    def __init__(self, window: int = TIMEOUT_WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def observe(self, provider: str, stage: Optional[str], latency: float):
+        self._samples[(provider, stage)].append(latency)
+
+    def quantile(self, provider: str, stage: Optional[str], q: float) -> Optional[float]:
+        samples = self._samples.get((provider, stage))
+        if not samples or len(samples) < TIMEOUT_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout_for(self, provider: str, stage: Optional[str]) -> float:
+        ceiling = STAGE_TIMEOUTS.get(stage, DEFAULT_TIMEOUT)
+        observed = self.quantile(provider, stage, TIMEOUT_QUANTILE)
+        if observed is None:
+            return ceiling
+        return min(ceiling, max(TIMEOUT_FLOOR, observed * TIMEOUT_FACTOR))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            f"{provider}/{stage}": {
+                "samples": len(samples),
+                "p50": self.quantile(provider, stage, 0.5),
+                "p90": self.quantile(provider, stage, 0.9),
+                "p99": self.quantile(provider, stage, 0.99),
+                "timeout": self.timeout_for(provider, stage),
+            }
+            for (provider, stage), samples in self._samples.items()
+        }
+
+
+tracker = LatencyTracker()
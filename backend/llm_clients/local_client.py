@@ -0,0 +1,76 @@
+"""Local OpenAI-compatible API client (llama.cpp server, vLLM, Ollama and similar)."""
+
+import asyncio
+import json
+import httpx
+from typing import List, Dict, Any, Optional
+from config import LOCAL_API_KEY, LOCAL_API_URL, LOCAL_STREAM, LOCAL_MAX_CONNECTIONS
+from .tracing import note_error
+
+MAX_OUTPUT_TOKENS = 4096
+
+# One pooled client per event loop: local calls are small and frequent, so reuse connections.
+_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+
+def _client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        limits = httpx.Limits(max_connections=LOCAL_MAX_CONNECTIONS, max_keepalive_connections=LOCAL_MAX_CONNECTIONS)
+        _clients[loop] = httpx.AsyncClient(limits=limits, timeout=None)  # the whole call is bounded in query_local
+    return _clients[loop]
+
+
+async def close_local_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+async def _read_stream(response: httpx.Response) -> Dict[str, Any]:
+    content = []
+    usage = {}
+    async for line in response.aiter_lines():
+        if not line.startswith("data: "):
+            continue
+        data = line[6:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        for choice in chunk.get('choices', []):
+            content.append(choice.get('delta', {}).get('content') or '')
+    return {'content': ''.join(content), 'usage': usage}
+
+
+async def query_local(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0, max_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    max_tokens = min(max_tokens, MAX_OUTPUT_TOKENS) if max_tokens else MAX_OUTPUT_TOKENS
+    headers = {"Content-Type": "application/json"}
+    if LOCAL_API_KEY:
+        headers["Authorization"] = f"Bearer {LOCAL_API_KEY}"
+    payload = {"model": model_id, "messages": messages, "max_tokens": max_tokens, "temperature": 0.3}
+    if LOCAL_STREAM:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+    try:
+        async with asyncio.timeout(timeout):
+            if LOCAL_STREAM:
+                async with _client().stream("POST", LOCAL_API_URL, headers=headers, json=payload) as response:
+                    response.raise_for_status()
+                    data = await _read_stream(response)
+                content, usage = data['content'], data['usage']
+            else:
+                response = await _client().post(LOCAL_API_URL, headers=headers, json=payload)
+                response.raise_for_status()
+                data = response.json()
+                content, usage = data['choices'][0]['message']['content'], data.get('usage', {})
+        return {
+            'content': content,
+            'usage': {'prompt_tokens': usage.get('prompt_tokens', 0), 'completion_tokens': usage.get('completion_tokens', 0), 'total_tokens': usage.get('total_tokens', 0), 'max_tokens': max_tokens}
+        }
+    except Exception as e:
+        note_error(e)
+        print(f"Error querying local model {model_id}: {e}")
+        return None
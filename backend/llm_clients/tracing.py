@@ -0,0 +1,103 @@
+"""Recording of provider call traces for offline replay.
+
+Every `query_model` call is appended to gzip-compressed JSON-lines files under
+TRACE_DIR, one file per UTC day and worker process. Records use short keys:
+
+    t   call start (unix seconds)       p   provider
+    r   council run id (or null)        m   model id
+    s   stage (stage1/stage2/stage3/title, or null)
+    l   latency (seconds)               pt  prompt tokens
+    ct  completion tokens               e   error code (null on success,
+                                            "cancelled" if abandoned in flight)
+
+Recording is disabled when TRACE_DIR is unset.
+"""
+
+import atexit
+import contextvars
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from config import TRACE_DIR, TRACE_FLUSH_EVERY
+
+current_run: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_run", default=None)
+current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_stage", default=None)
+_last_error: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("last_error", default=None)
+
+_buffer: List[Dict[str, Any]] = []
+
+
+def begin_run() -> str:
+    """Tag subsequent calls in this context as belonging to a new council run."""
+    run_id = uuid.uuid4().hex[:12]
+    current_run.set(run_id)
+    return run_id
+
+
+def note_error(error: Exception):
+    """Remember why the current provider call failed; clients call this from their error handlers."""
+    if isinstance(error, httpx.HTTPStatusError):
+        code = str(error.response.status_code)
+    elif isinstance(error, (httpx.TimeoutException, TimeoutError)):
+        code = "timeout"
+    else:
+        code = type(error).__name__
+    _last_error.set(code)
+
+
+def last_error() -> Optional[str]:
+    return _last_error.get()
+
+
+def reset_error():
+    _last_error.set(None)
+
+
+def record(provider: str, model_id: str, started: float, latency: float, result: Optional[Dict[str, Any]], error: Optional[str] = None):
+    if not TRACE_DIR:
+        return
+    usage = (result or {}).get('usage', {})
+    _buffer.append({
+        "t": round(started, 3),
+        "r": current_run.get(),
+        "s": current_stage.get(),
+        "p": provider,
+        "m": model_id,
+        "l": round(latency, 3),
+        "pt": usage.get('prompt_tokens', 0),
+        "ct": usage.get('completion_tokens', 0),
+        "e": error or (None if result is not None else (_last_error.get() or "error")),
+    })
+    if len(_buffer) >= TRACE_FLUSH_EVERY:
+        flush()
+
+
+def flush():
+    if not TRACE_DIR or not _buffer:
+        return
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"calls-{datetime.utcnow():%Y%m%d}-{os.getpid()}.jsonl.gz")
+    # Each flush appends a new gzip member; readers see the concatenation as one stream.
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for entry in _buffer:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    _buffer.clear()
+
+
+def load(trace_dir: str) -> Iterator[Dict[str, Any]]:
+    """Yield every recorded call under `trace_dir`, in file order."""
+    for name in sorted(os.listdir(trace_dir)):
+        if name.endswith(".jsonl.gz"):
+            with gzip.open(os.path.join(trace_dir, name), "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+atexit.register(flush)
@@ -3,13 +3,15 @@
 import httpx
 from typing import List, Dict, Any, Optional
 from config import XAI_API_KEY, XAI_API_URL
+from .tracing import note_error
 
 MAX_OUTPUT_TOKENS = 16384
 
 
-async def query_grok(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0) -> Optional[Dict[str, Any]]:
+async def query_grok(model_id: str, messages: List[Dict[str, str]], timeout: float = 180.0, max_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    max_tokens = min(max_tokens, MAX_OUTPUT_TOKENS) if max_tokens else MAX_OUTPUT_TOKENS
     headers = {"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"}
-    payload = {"model": model_id, "messages": messages, "max_tokens": MAX_OUTPUT_TOKENS, "temperature": 0.3}
+    payload = {"model": model_id, "messages": messages, "max_tokens": max_tokens, "temperature": 0.3}
 
     try:
         async with httpx.AsyncClient(timeout=timeout) as client:
@@ -19,8 +21,9 @@ async def query_grok(model_id: str, messages: List[Dict[str, str]], timeout: flo
             usage = data.get('usage', {})
             return {
                 'content': data['choices'][0]['message']['content'],
-                'usage': {'prompt_tokens': usage.get('prompt_tokens', 0), 'completion_tokens': usage.get('completion_tokens', 0), 'total_tokens': usage.get('total_tokens', 0), 'max_tokens': MAX_OUTPUT_TOKENS}
+                'usage': {'prompt_tokens': usage.get('prompt_tokens', 0), 'completion_tokens': usage.get('completion_tokens', 0), 'total_tokens': usage.get('total_tokens', 0), 'max_tokens': max_tokens}
             }
     except Exception as e:
+        note_error(e)
         print(f"Error querying Grok {model_id}: {e}")
         return None
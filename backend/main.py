@@ -1,24 +1,27 @@
 """FastAPI backend for The Board Room - XMARCS Strategic Council."""
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 import uuid
 import json
 import asyncio
+import weakref
 
 import storage
+import singleflight
+import admission
+from llm_clients.latency import tracker
+from llm_clients.hedging import policy as hedge_policy
+from llm_clients.local_client import close_local_clients
 from council import (
     run_full_council,
     generate_conversation_title,
-    stage1_collect_responses,
-    stage2_collect_rankings,
-    stage3_synthesize_final,
-    calculate_aggregate_rankings
+    stream_council
 )
-from config import CORS_ORIGINS
+from config import CORS_ORIGINS, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_HOURS, COUNCIL_CANCEL_CHANNEL, SINGLE_FLIGHT_CHANNEL
 
 app = FastAPI(title="The Board Room API", version="1.0.0")
 
@@ -43,9 +46,90 @@ class UpdateConversationRequest(BaseModel):
     title: str
 
 
+# Cancel signals for council streams served by this worker, keyed by conversation id
+active_streams: Dict[str, asyncio.Event] = {}
+
+
+def cancel_local_stream(conversation_id: str):
+    cancel = active_streams.get(conversation_id)
+    if cancel is not None:
+        cancel.set()
+
+
+async def admitted_council(user_query: str, client: str, ticket) -> AsyncIterator[Dict[str, Any]]:
+    """Run the council under an admission slot that it holds until the run ends.
+
+    The slot belongs to the run, not to whichever caller started it. A caller that
+    skipped the queue to follow a run that then finished before it attached arrives
+    here without a ticket, and is admitted like any other.
+    """
+    if ticket is None:
+        ticket = admission.controller().enqueue(client)
+    try:
+        async for position in admission.controller().wait(ticket):
+            yield {'type': 'queued', 'position': position}
+        async for event in stream_council(user_query):
+            yield event
+    finally:
+        admission.controller().release(ticket)
+
+
+async def until_cancelled(events: AsyncIterator[Dict[str, Any]], cancel: asyncio.Event) -> AsyncIterator[Dict[str, Any]]:
+    """Yield from `events` until `cancel` is set, then abandon it.
+
+    Cleanup never awaits, so it also runs correctly when the client disconnects and
+    the response task is cancelled: the pending step is cancelled, which unwinds
+    `events` and everything it is waiting on.
+    """
+    events = events.__aiter__()
+    waiter = asyncio.ensure_future(cancel.wait())
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({step, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                return
+            try:
+                event = step.result()
+            except StopAsyncIteration:
+                return
+            step = None
+            yield event
+    finally:
+        waiter.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+        elif step is None:
+            asyncio.ensure_future(events.aclose())
+
+
+async def archive_loop():
+    """Periodically move old stage-1/2 detail to the compressed archive tier."""
+    while True:
+        try:
+            report = await asyncio.to_thread(storage.compact_conversations, ARCHIVE_AFTER_DAYS)
+            if report["conversations"]:
+                print(f"Archived {report['conversations']} conversations, reclaimed {report['bytes_reclaimed']} bytes "
+                      f"({report['hot_bytes_before']} -> {report['hot_bytes_after']} hot, {report['archive_bytes']} archived)")
+        except Exception as e:
+            print(f"Error compacting conversations: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
 @app.on_event("startup")
 async def startup_event():
     storage.init_db()
+    loop = asyncio.get_running_loop()
+    storage.subscribe(COUNCIL_CANCEL_CHANNEL, lambda conversation_id: loop.call_soon_threadsafe(cancel_local_stream, conversation_id))
+    storage.subscribe(SINGLE_FLIGHT_CHANNEL, lambda key: loop.call_soon_threadsafe(singleflight.abandoned, key))
+    storage.start_change_listener()
+    asyncio.create_task(archive_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_local_clients()
 
 
 @app.get("/")
@@ -53,6 +137,26 @@ async def root():
     return {"status": "ok", "service": "The Board Room API", "version": "1.0.0"}
 
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return storage.cache_stats()
+
+
+@app.get("/api/admission/stats")
+async def admission_stats():
+    return admission.controller().stats()
+
+
+@app.get("/api/latency/stats")
+async def latency_stats():
+    return tracker.snapshot()
+
+
+@app.get("/api/hedging/stats")
+async def hedging_stats():
+    return hedge_policy.stats()
+
+
 @app.get("/api/conversations")
 async def list_conversations():
     return storage.list_conversations()
@@ -84,6 +188,13 @@ async def update_conversation(conversation_id: str, request: UpdateConversationR
     return {"status": "updated"}
 
 
+@app.post("/api/conversations/{conversation_id}/cancel")
+async def cancel_message_stream(conversation_id: str):
+    cancel_local_stream(conversation_id)
+    storage.notify(COUNCIL_CANCEL_CHANNEL, conversation_id)
+    return {"status": "cancelling"}
+
+
 @app.get("/api/conversations/{conversation_id}/export")
 async def export_conversation(conversation_id: str):
     conversation = storage.get_conversation(conversation_id)
@@ -101,43 +212,102 @@ async def export_conversation(conversation_id: str):
 
 
 @app.post("/api/conversations/{conversation_id}/message/stream")
-async def send_message_stream(conversation_id: str, request: SendMessageRequest):
+async def send_message_stream(conversation_id: str, request: SendMessageRequest, http_request: Request):
     conversation = storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
+    # Following an identical run that is already in flight costs no provider calls, so it skips the queue.
+    client = admission.client_key(http_request.client.host, http_request.headers.get("x-forwarded-for"))
+    ticket = None
+    if not singleflight.in_flight(request.content):
+        try:
+            ticket = admission.controller().enqueue(client)
+        except admission.QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
     is_first_message = len(conversation["messages"]) == 0
+    cancel = asyncio.Event()
+    active_streams[conversation_id] = cancel
+
+    def release_slot():
+        nonlocal ticket
+        admission.controller().release(ticket)
+        ticket = None
+
+    def release():
+        if active_streams.get(conversation_id) is cancel:
+            del active_streams[conversation_id]
+        release_slot()
+
+    def lead():
+        # Only called if this caller starts the run, which then takes over its slot.
+        nonlocal ticket
+        held, ticket = ticket, None
+        return admitted_council(request.content, client, held)
 
     async def event_generator():
+        title_task = None
+        stream = None
+        results = {}
+        settled = False
         try:
+            if ticket is not None:
+                async for position in until_cancelled(admission.controller().wait(ticket), cancel):
+                    yield f"data: {json.dumps({'type': 'queued', 'position': position})}\n\n"
+                if cancel.is_set():
+                    yield f"data: {json.dumps({'type': 'cancelled'})}\n\n"
+                    return
+
             storage.add_user_message(conversation_id, request.content)
 
-            title_task = None
             if is_first_message:
                 title_task = asyncio.create_task(generate_conversation_title(request.content))
 
-            yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-            stage1_results = await stage1_collect_responses(request.content)
-            yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'stage2_start'})}\n\n"
-            stage2_results, label_to_model = await stage2_collect_rankings(request.content, stage1_results)
-            aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
-            yield f"data: {json.dumps({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
-            stage3_result = await stage3_synthesize_final(request.content, stage1_results, stage2_results)
-            yield f"data: {json.dumps({'type': 'stage3_complete', 'data': stage3_result})}\n\n"
+            # Identical concurrent questions share one council run; this caller may only be following it.
+            stream = until_cancelled(singleflight.run(request.content, lead), cancel)
+            async for event in stream:
+                # Attached to a run: if another caller leads it, this one's slot is not needed.
+                release_slot()
+                if event['type'] == 'error':
+                    settled = True
+                    yield f"data: {json.dumps(event)}\n\n"
+                    return
+                if event['type'] == 'cancelled':
+                    break
+                yield f"data: {json.dumps(event)}\n\n"
+                if 'data' in event:
+                    results[event['type']] = event['data']
+
+            if 'stage3_complete' not in results:
+                yield f"data: {json.dumps({'type': 'cancelled'})}\n\n"
+                return
 
             if title_task:
                 title = await title_task
                 storage.update_conversation_title(conversation_id, title)
                 yield f"data: {json.dumps({'type': 'title_complete', 'data': {'title': title}})}\n\n"
 
-            storage.add_assistant_message(conversation_id, stage1_results, stage2_results, stage3_result)
+            storage.add_assistant_message(conversation_id, results['stage1_complete'], results['stage2_complete'], results['stage3_complete'])
+            settled = True
             yield f"data: {json.dumps({'type': 'complete'})}\n\n"
 
         except Exception as e:
+            settled = True
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        finally:
+            # Runs on stop, on client disconnect and on normal completion; nothing here may await.
+            release()
+            if title_task is not None and not title_task.done():
+                title_task.cancel()
+            if stream is not None:
+                asyncio.ensure_future(stream.aclose())
+            if not settled and results:
+                # Keep the stages that finished, and the token usage they carry.
+                storage.add_assistant_message(conversation_id, results.get('stage1_complete', []), results.get('stage2_complete', []), None, cancelled=True)
+
+    events = event_generator()
+    # If the client goes away before the stream starts, the generator's finally never runs.
+    weakref.finalize(events, release)
+    return StreamingResponse(events, media_type="text/event-stream")
@@ -0,0 +1,241 @@
+"""Offline replay of recorded provider traces through the council orchestration.
+
+Runs `council.run_full_council` against a virtual clock: provider calls are
+answered from the trace log (see `llm_clients.tracing`) after sleeping for their
+recorded latency, so a day of traffic replays in seconds with no network. Each
+policy can override the per-call timeout (otherwise timeouts are learned online
+from replayed latencies, as in production), the stage 1/2 quorum, a per-provider
+concurrency limit and model routing, and the report compares council latency
+percentiles and cost across policies.
+
+Billing model: a call that returns is charged its recorded usage, a call cut
+short by a timeout or quorum cancellation is charged its prompt tokens only,
+and a call that failed in production is not charged.
+
+Usage:
+    python simulator.py TRACE_DIR [--policies policies.json] [--seed N]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import random
+import re
+import selectors
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+import config
+import council
+import llm_clients
+from llm_clients import tracing
+from llm_clients.latency import LatencyTracker
+
+DEFAULT_POLICIES = [
+    {"name": "baseline"},
+    {"name": "timeout-60s", "timeout": 60.0},
+    {"name": "quorum-3", "quorum": 3},
+    {"name": "concurrency-4", "concurrency": 4},
+]
+
+_replaying: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("replaying", default=None)
+_bill: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar("bill", default=None)
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    """Selector that never blocks: waiting for the next timer just advances the clock."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Simulation deadlocked: nothing scheduled and nothing ready")
+        self.now += timeout
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self._virtual_selector = _VirtualSelector()
+        super().__init__(self._virtual_selector)
+
+    def time(self) -> float:
+        return self._virtual_selector.now
+
+
+def _price(model_id: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = config.MODEL_PRICES.get(model_id, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class TraceReplay:
+    """Indexes a trace log by council run and by (stage, provider, model) for sampling."""
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.by_run = defaultdict(lambda: defaultdict(list))
+        self.by_stage = defaultdict(list)
+        self.by_model = defaultdict(list)
+        arrivals = {}
+
+        # A call cancelled in flight says nothing about how long the provider would have taken.
+        records = [record for record in records if record['e'] != "cancelled"]
+        self.records = records
+        for record in records:
+            key = (record['p'], record['m'])
+            self.by_stage[(record['s'],) + key].append(record)
+            self.by_model[key].append(record)
+            if record['r']:
+                self.by_run[record['r']][(record['s'],) + key].append(record)
+                arrivals[record['r']] = min(arrivals.get(record['r'], record['t']), record['t'])
+
+        start = min(arrivals.values()) if arrivals else 0.0
+        self.arrivals = sorted((t - start, run) for run, t in arrivals.items())
+
+    def sample(self, rng: random.Random, run: Optional[str], stage: Optional[str], provider: str, model_id: str) -> Dict[str, Any]:
+        """Prefer the replayed run's own call; fall back to the model's stage, then the model, then anything."""
+        own = self.by_run.get(run, {}).get((stage, provider, model_id))
+        if own:
+            return own.pop(0) if len(own) > 1 else own[0]
+        for pool in (self.by_stage.get((stage, provider, model_id)), self.by_model.get((provider, model_id)), self.records):
+            if pool:
+                return rng.choice(pool)
+        raise ValueError("Trace log is empty")
+
+
+def _synthetic_content(stage: Optional[str], model_id: str, messages: List[Dict[str, str]], rng: random.Random) -> str:
+    if stage == "stage2":
+        labels = re.findall(r'^Response ([A-Z]+):', messages[-1]['content'], re.MULTILINE)
+        rng.shuffle(labels)
+        return "FINAL RANKING:\n" + "\n".join(f"{i}. Response {label}" for i, label in enumerate(labels, start=1))
+    return f"[simulated {model_id} response]"
+
+
+def _route(model_config: Dict[str, str], routes: Dict[str, Dict[str, str]]) -> Dict[str, str]:
+    routed = routes.get(model_config['name'])
+    return {**model_config, **routed} if routed else model_config
+
+
+@contextmanager
+def _policy_applied(policy: Dict[str, Any], replay_call):
+    routes = policy.get("routes", {})
+    saved = (council.COUNCIL_MODELS, council.CHAIRMAN_MODEL, council.COUNCIL_QUORUM, council.query_model, llm_clients.query_model)
+    council.COUNCIL_MODELS = [_route(m, routes) for m in config.COUNCIL_MODELS]
+    council.CHAIRMAN_MODEL = _route(config.CHAIRMAN_MODEL, routes)
+    council.COUNCIL_QUORUM = policy.get("quorum", config.COUNCIL_QUORUM)
+    council.query_model = replay_call
+    llm_clients.query_model = replay_call
+    try:
+        yield
+    finally:
+        council.COUNCIL_MODELS, council.CHAIRMAN_MODEL, council.COUNCIL_QUORUM, council.query_model, llm_clients.query_model = saved
+
+
+def simulate_policy(replay: TraceReplay, policy: Dict[str, Any], seed: int = 0) -> Dict[str, Any]:
+    """Replay every recorded council under `policy` and summarize latency and cost."""
+    rng = random.Random(seed)
+    tracker = LatencyTracker()
+    latencies: List[float] = []
+    costs: List[float] = []
+
+    async def replay_call(provider, model_id, messages, timeout=None, max_tokens=None):
+        stage = tracing.current_stage.get()
+        sample = replay.sample(rng, _replaying.get(), stage, provider, model_id)
+        limit = policy.get("timeout") or timeout or tracker.timeout_for(provider, stage)
+        bill = _bill.get()
+        semaphore = semaphores[provider] if semaphores is not None else nullcontext()
+        async with semaphore:
+            try:
+                await asyncio.sleep(min(sample['l'], limit))
+            except asyncio.CancelledError:
+                bill.append(_price(model_id, sample['pt'], 0))
+                raise
+        if sample['l'] > limit:
+            tracker.observe(provider, stage, limit)
+            bill.append(_price(model_id, sample['pt'], 0))
+            return None
+        if sample['e']:
+            return None
+        tracker.observe(provider, stage, sample['l'])
+        bill.append(_price(model_id, sample['pt'], sample['ct']))
+        return {
+            'content': _synthetic_content(stage, model_id, messages, rng),
+            'usage': {'prompt_tokens': sample['pt'], 'completion_tokens': sample['ct'], 'total_tokens': sample['pt'] + sample['ct']}
+        }
+
+    async def replay_council(offset: float, run: str):
+        await asyncio.sleep(offset)
+        _replaying.set(run)
+        bill: List[float] = []
+        _bill.set(bill)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await council.run_full_council("Replayed question")
+        latencies.append(loop.time() - started)
+        costs.append(sum(bill))
+
+    async def main():
+        await asyncio.gather(*(replay_council(offset, run) for offset, run in replay.arrivals))
+
+    concurrency = policy.get("concurrency")
+    loop = VirtualClockLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        semaphores = defaultdict(lambda: asyncio.Semaphore(concurrency)) if concurrency else None
+        with _policy_applied(policy, replay_call):
+            loop.run_until_complete(main())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    return {
+        "policy": policy.get("name", "unnamed"),
+        "councils": len(latencies),
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "mean_cost": sum(costs) / len(costs) if costs else 0.0,
+        "total_cost": sum(costs),
+    }
+
+
+def format_report(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'policy':<20} {'councils':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'$/council':>10} {'total $':>10}"]
+    for row in rows:
+        lines.append(
+            f"{row['policy']:<20} {row['councils']:>8} {row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} "
+            f"{row['mean_cost']:>10.4f} {row['total_cost']:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay provider traces through the council under alternative policies.")
+    parser.add_argument("trace_dir")
+    parser.add_argument("--policies", help="JSON file with a list of policy objects (default: built-in comparison set)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    policies = DEFAULT_POLICIES
+    if args.policies:
+        with open(args.policies) as f:
+            policies = json.load(f)
+
+    records = list(tracing.load(args.trace_dir))
+    rows = [simulate_policy(TraceReplay([dict(r) for r in records]), policy, args.seed) for policy in policies]
+    print(format_report(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Single-flight deduplication of identical in-flight council runs.
+
+Concurrent requests with the same normalized question and council configuration
+share one council run instead of each paying for a full set of provider calls.
+
+Within a worker, followers attach to the leader's in-memory event log. Across
+uvicorn workers and nodes, the leader holds a Postgres advisory lock for the
+lifetime of the run and mirrors its events into the `council_runs` table, which
+followers elsewhere tail. Postgres drops the lock when the leader's session dies,
+so a crashed leader is detected and its run expires instead of stranding followers.
+Followers register in `council_run_followers` and heartbeat while they wait, so one
+whose worker crashed stops counting after SINGLE_FLIGHT_FOLLOWER_TTL.
+
+A run is cancelled, along with its in-flight provider calls, once every caller
+following it has gone away. The leader re-checks when its own callers leave and
+after every event; the last follower on another worker to leave also wakes it
+with a notification on SINGLE_FLIGHT_CHANNEL.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+import storage
+from config import COUNCIL_MODELS, CHAIRMAN_MODEL, REVIEWER_MODELS, PRESUMMARIZER_MODEL, SINGLE_FLIGHT_POLL_INTERVAL, SINGLE_FLIGHT_RETENTION_HOURS, SINGLE_FLIGHT_FOLLOWER_TTL, SINGLE_FLIGHT_CHANNEL
+
+
+class _Flight:
+    """In-memory event log of a council run that any number of callers can follow."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.cond = asyncio.Condition()
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.shared = False
+
+    async def publish(self, event: Optional[Dict[str, Any]] = None, done: bool = False):
+        async with self.cond:
+            if event is not None:
+                self.events.append(event)
+            self.done = self.done or done
+            self.cond.notify_all()
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: len(self.events) > index or self.done)
+                pending = self.events[index:]
+                done = self.done
+            index += len(pending)
+            for event in pending:
+                yield event
+            if done:
+                return
+
+
+_flights: Dict[str, _Flight] = {}
+
+
+def flight_key(user_query: str) -> str:
+    """Key a run by its normalized question and the council that would answer it."""
+    normalized = " ".join(user_query.lower().split())
+    council = json.dumps([COUNCIL_MODELS, CHAIRMAN_MODEL, REVIEWER_MODELS, PRESUMMARIZER_MODEL], sort_keys=True)
+    return hashlib.sha256(f"{council}\n{normalized}".encode()).hexdigest()
+
+
+def in_flight(user_query: str) -> bool:
+    """Whether this worker is already running the council for `user_query`."""
+    return flight_key(user_query) in _flights
+
+
+def _lock_id(key: str) -> int:
+    return int.from_bytes(bytes.fromhex(key)[:8], "big", signed=True)
+
+
+def _is_shared() -> bool:
+    return storage.engine.dialect.name == "postgresql"
+
+
+def _try_lock(key: str):
+    """Take the run's advisory lock on a dedicated connection, or return None if another session holds it."""
+    conn = storage.engine.connect()
+    try:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _lock_id(key)}).scalar()
+        conn.commit()
+    except Exception:
+        conn.close()
+        raise
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+def _unlock(key: str, conn):
+    try:
+        conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _lock_id(key)})
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def _lead(key: str, flight: _Flight, producer: Callable[[], AsyncIterator[Dict[str, Any]]], conn):
+    status = "failed"
+    events = producer()
+    try:
+        if conn is not None:
+            storage.prune_council_runs(datetime.utcnow() - timedelta(hours=SINGLE_FLIGHT_RETENTION_HOURS))
+            storage.save_council_run(key, "running", [])
+        async for event in events:
+            await flight.publish(event)
+            if conn is not None:
+                storage.save_council_run(key, "running", flight.events)
+                if _is_abandoned(key, flight):
+                    raise asyncio.CancelledError()
+        status = "complete"
+    except asyncio.CancelledError:
+        status = "cancelled"
+        await flight.publish({'type': 'cancelled'})
+    except Exception as e:
+        await flight.publish({'type': 'error', 'message': str(e)})
+    finally:
+        _flights.pop(key, None)
+        await events.aclose()
+        if conn is not None:
+            try:
+                storage.save_council_run(key, status, flight.events)
+            finally:
+                _unlock(key, conn)
+        await flight.publish(done=True)
+
+
+def _start(key: str, producer: Callable[[], AsyncIterator[Dict[str, Any]]], conn) -> _Flight:
+    flight = _Flight()
+    flight.shared = conn is not None
+    _flights[key] = flight
+    # The run is driven by its own task so followers still get results if the caller that started it goes away.
+    flight.task = asyncio.create_task(_lead(key, flight, producer, conn))
+    return flight
+
+
+def _leave(key: str, flight: _Flight):
+    """Drop a local follower, cancelling the run if that was the last one anywhere."""
+    flight.followers -= 1
+    _cancel_if_abandoned(key, flight)
+
+
+def _is_abandoned(key: str, flight: _Flight) -> bool:
+    if flight.followers > 0 or flight.done:
+        return False
+    if flight.shared:
+        run = storage.get_council_run(key)
+        if run and run['followers'] > 0:
+            return False
+    return True
+
+
+def _cancel_if_abandoned(key: str, flight: _Flight):
+    if _is_abandoned(key, flight):
+        flight.task.cancel()
+
+
+def abandoned(key: str):
+    """Handle a SINGLE_FLIGHT_CHANNEL notification: cancel this worker's run of `key` if nobody follows it."""
+    flight = _flights.get(key)
+    if flight is not None:
+        _cancel_if_abandoned(key, flight)
+
+
+async def _follow_remote(key: str, takeover: list) -> AsyncIterator[Dict[str, Any]]:
+    """Tail a run led by another worker. If its leader vanishes first, hand the lock back through `takeover`."""
+    follower_id = uuid.uuid4().hex
+    joined = storage.join_council_run(key, follower_id)
+    try:
+        async for event in _tail_run(key, follower_id, joined, takeover):
+            yield event
+    finally:
+        left = storage.leave_council_run(key, follower_id)
+        if left and left['followers'] == 0 and left['status'] in ('running', 'waiting'):
+            storage.notify(SINGLE_FLIGHT_CHANNEL, key)
+
+
+def _is_current(run: Optional[Dict[str, Any]], joined: Dict[str, Any]) -> bool:
+    """Whether `run` is the run this follower joined rather than a finished row left by an earlier one.
+
+    A finished row is stale until a leader rewrites it, so it is compared with the row as
+    it was at join time instead of against this node's clock.
+    """
+    if run is None or run['status'] == 'waiting':
+        return False
+    if run['status'] == 'running':
+        return True
+    return (run['status'], run['updated_at']) != (joined['status'], joined['updated_at'])
+
+
+async def _tail_run(key: str, follower_id: str, joined: Dict[str, Any], takeover: list) -> AsyncIterator[Dict[str, Any]]:
+    index = 0
+    last_seen = time.monotonic()
+    while True:
+        if time.monotonic() - last_seen > SINGLE_FLIGHT_FOLLOWER_TTL / 3:
+            storage.touch_council_run_follower(key, follower_id)
+            last_seen = time.monotonic()
+        run = storage.get_council_run(key)
+        if _is_current(run, joined):
+            pending = run['events'][index:]
+            index += len(pending)
+            for event in pending:
+                yield event
+            if run['status'] != 'running':
+                return
+
+        conn = _try_lock(key)
+        if conn is not None:
+            # The leader may have finished and released the lock since the read above.
+            run = storage.get_council_run(key)
+            if _is_current(run, joined) and run['status'] != 'running':
+                _unlock(key, conn)
+                for event in run['events'][index:]:
+                    yield event
+                return
+            if index == 0:
+                takeover.append(conn)
+                return
+            storage.save_council_run(key, "failed", run['events'] if run else [])
+            _unlock(key, conn)
+            yield {'type': 'error', 'message': 'Council run was abandoned by its leader'}
+            return
+
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+async def run(user_query: str, producer: Callable[[], AsyncIterator[Dict[str, Any]]]) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the events of the council run for `user_query`, starting it via `producer` only if none is in flight."""
+    key = flight_key(user_query)
+    flight = _flights.get(key)
+
+    if flight is None and _is_shared():
+        conn = _try_lock(key)
+        if conn is None:
+            takeover = []
+            async for event in _follow_remote(key, takeover):
+                yield event
+            if not takeover:
+                return
+            conn = takeover[0]
+        flight = _start(key, producer, conn)
+    elif flight is None:
+        flight = _start(key, producer, None)
+
+    flight.followers += 1
+    try:
+        async for event in flight.follow():
+            yield event
+    finally:
+        _leave(key, flight)
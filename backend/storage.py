@@ -1,12 +1,20 @@
 """PostgreSQL database models and storage."""
 
-from sqlalchemy import create_engine, Column, String, DateTime, JSON
+from sqlalchemy import create_engine, Column, String, DateTime, JSON, Integer, LargeBinary, Text, cast, func, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from collections import OrderedDict
+import json
+import select
+import threading
+import time
 
-from config import DATABASE_URL
+import zstandard
+
+from config import DATABASE_URL, ARCHIVE_DICT_SIZE, ARCHIVE_ZSTD_LEVEL, ARCHIVE_BATCH_SIZE, SINGLE_FLIGHT_FOLLOWER_TTL, CONVERSATION_CACHE_SIZE, CONVERSATION_CACHE_CHANNEL
 
 Base = declarative_base()
 engine = create_engine(DATABASE_URL)
@@ -21,6 +29,194 @@ class Conversation(Base):
     messages = Column(JSON, default=list)
 
 
+class ConversationArchive(Base):
+    """Cold tier: zstd-compressed stage-1/2 detail of old conversations, keyed by message index."""
+    __tablename__ = "conversation_archives"
+    conversation_id = Column(String, primary_key=True)
+    dictionary_id = Column(Integer, nullable=True)
+    payload = Column(LargeBinary)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchiveDictionary(Base):
+    """Shared zstd dictionary trained on stage-1/2 text; archives name the one they were compressed with."""
+    __tablename__ = "archive_dictionaries"
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CouncilRun(Base):
+    """Shared event log of an in-flight council run, used for cross-worker single-flight."""
+    __tablename__ = "council_runs"
+    key = Column(String, primary_key=True)
+    status = Column(String, default="running")
+    events = Column(JSON, default=list)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CouncilRunFollower(Base):
+    """A caller tailing a council run from another worker. Followers refresh `seen_at` (database
+    time) while they wait, so one whose worker died stops counting after SINGLE_FLIGHT_FOLLOWER_TTL."""
+    __tablename__ = "council_run_followers"
+    key = Column(String, primary_key=True)
+    follower_id = Column(String, primary_key=True)
+    seen_at = Column(DateTime)
+
+
+class ConversationCache:
+    """Bounded LRU of conversation dicts plus the conversation list, with hit/miss accounting.
+
+    Cached values are shared between callers and must not be mutated. A read that
+    raced with a write is not cached: `put` is ignored if anything was invalidated
+    since the caller took its `generation()` snapshot.
+    """
+
+    def __init__(self, max_entries: int, enabled: bool = True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._summaries: Optional[Tuple[List[Dict[str, Any]], int]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        return self._generation
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(conversation_id) if self.enabled else None
+            self._count(entry is not None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(conversation_id)
+            return entry[0]
+
+    def put(self, conversation_id: str, conversation: Dict[str, Any], generation: int):
+        size = len(json.dumps(conversation, default=str))
+        with self._lock:
+            if not self.enabled or generation != self._generation:
+                return
+            self._entries[conversation_id] = (conversation, size)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_summaries(self) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            summaries = self._summaries if self.enabled else None
+            self._count(summaries is not None)
+            return summaries[0] if summaries else None
+
+    def put_summaries(self, summaries: List[Dict[str, Any]], generation: int):
+        size = len(json.dumps(summaries, default=str))
+        with self._lock:
+            if self.enabled and generation == self._generation:
+                self._summaries = (summaries, size)
+
+    def invalidate(self, conversation_id: Optional[str] = None):
+        """Drop one conversation (and the list, which summarizes it), or everything when no id is given."""
+        with self._lock:
+            self._generation += 1
+            self._summaries = None
+            if conversation_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(size for _, size in self._entries.values()) + (self._summaries[1] if self._summaries else 0),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# With Postgres, other workers' writes arrive over LISTEN/NOTIFY, so the cache stays off until the listener is up.
+_cache = ConversationCache(CONVERSATION_CACHE_SIZE, enabled=engine.dialect.name != "postgresql")
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _cache.stats()
+
+
+def _notify_changed(db, conversation_id: str):
+    """Announce a write to other workers; delivered only if the surrounding transaction commits."""
+    if engine.dialect.name == "postgresql":
+        db.execute(text("SELECT pg_notify(:channel, :id)"), {"channel": CONVERSATION_CACHE_CHANNEL, "id": conversation_id})
+
+
+_subscribers: Dict[str, Callable[[str], None]] = {}
+
+
+def subscribe(channel: str, callback: Callable[[str], None]):
+    """Call `callback(payload)` from the listener thread for every notification on `channel`. Register before start_change_listener."""
+    _subscribers[channel] = callback
+
+
+def notify(channel: str, payload: str):
+    """Send a notification to every worker (Postgres only)."""
+    if engine.dialect.name != "postgresql":
+        return
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _listen_for_changes():
+    while True:
+        try:
+            pooled = engine.raw_connection()
+            pooled.detach()
+            conn = pooled.driver_connection
+            conn.autocommit = True
+            try:
+                for channel in [CONVERSATION_CACHE_CHANNEL, *_subscribers]:
+                    conn.cursor().execute(f"LISTEN {channel}")
+                # Anything cached before LISTEN took effect may have missed a notification.
+                _cache.invalidate()
+                _cache.enabled = True
+                while True:
+                    if select.select([conn], [], [], 30) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            notification = conn.notifies.pop(0)
+                            if notification.channel == CONVERSATION_CACHE_CHANNEL:
+                                _cache.invalidate(notification.payload)
+                            elif notification.channel in _subscribers:
+                                _subscribers[notification.channel](notification.payload)
+            finally:
+                _cache.enabled = False
+                _cache.invalidate()
+                conn.close()
+        except Exception as e:
+            print(f"Error listening for conversation changes: {e}")
+            time.sleep(5)
+
+
+def start_change_listener():
+    """Keep this worker's cache coherent with writes made by other workers, and deliver subscribed notifications."""
+    if engine.dialect.name == "postgresql":
+        threading.Thread(target=_listen_for_changes, name="conversation-change-listener", daemon=True).start()
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
 
@@ -30,29 +226,46 @@ def create_conversation(conversation_id: str) -> Dict[str, Any]:
     try:
         conversation = Conversation(id=conversation_id, created_at=datetime.utcnow(), title="New Conversation", messages=[])
         db.add(conversation)
+        _notify_changed(db, conversation_id)
         db.commit()
         db.refresh(conversation)
+        _cache.invalidate(conversation_id)
         return {"id": conversation.id, "created_at": conversation.created_at.isoformat(), "title": conversation.title, "messages": conversation.messages}
     finally:
         db.close()
 
 
 def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    cached = _cache.get(conversation_id)
+    if cached is not None:
+        return cached
+    generation = _cache.generation()
     db = SessionLocal()
     try:
         conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
         if not conversation:
             return None
-        return {"id": conversation.id, "created_at": conversation.created_at.isoformat(), "title": conversation.title, "messages": conversation.messages}
+        messages = conversation.messages
+        if any(msg.get("archived") for msg in messages or []):
+            messages = _rehydrate(db, conversation_id, messages)
+        result = {"id": conversation.id, "created_at": conversation.created_at.isoformat(), "title": conversation.title, "messages": messages}
+        _cache.put(conversation_id, result, generation)
+        return result
     finally:
         db.close()
 
 
 def list_conversations() -> List[Dict[str, Any]]:
+    cached = _cache.get_summaries()
+    if cached is not None:
+        return cached
+    generation = _cache.generation()
     db = SessionLocal()
     try:
         conversations = db.query(Conversation).order_by(Conversation.created_at.desc()).all()
-        return [{"id": conv.id, "created_at": conv.created_at.isoformat(), "title": conv.title, "message_count": len(conv.messages)} for conv in conversations]
+        result = [{"id": conv.id, "created_at": conv.created_at.isoformat(), "title": conv.title, "message_count": len(conv.messages)} for conv in conversations]
+        _cache.put_summaries(result, generation)
+        return result
     finally:
         db.close()
 
@@ -60,25 +273,29 @@ def list_conversations() -> List[Dict[str, Any]]:
 def add_user_message(conversation_id: str, content: str):
     db = SessionLocal()
     try:
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).with_for_update().first()
         if conversation:
-            messages = conversation.messages or []
-            messages.append({"role": "user", "content": content})
-            conversation.messages = messages
+            # Assign a new list: SQLAlchemy does not detect in-place changes to a JSON column.
+            conversation.messages = (conversation.messages or []) + [{"role": "user", "content": content}]
+            _notify_changed(db, conversation_id)
             db.commit()
+            _cache.invalidate(conversation_id)
     finally:
         db.close()
 
 
-def add_assistant_message(conversation_id: str, stage1: List, stage2: List, stage3: str):
+def add_assistant_message(conversation_id: str, stage1: List, stage2: List, stage3: Optional[str], cancelled: bool = False):
     db = SessionLocal()
     try:
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).with_for_update().first()
         if conversation:
-            messages = conversation.messages or []
-            messages.append({"role": "assistant", "stage1": stage1, "stage2": stage2, "stage3": stage3})
-            conversation.messages = messages
+            message = {"role": "assistant", "stage1": stage1, "stage2": stage2, "stage3": stage3}
+            if cancelled:
+                message["cancelled"] = True
+            conversation.messages = (conversation.messages or []) + [message]
+            _notify_changed(db, conversation_id)
             db.commit()
+            _cache.invalidate(conversation_id)
     finally:
         db.close()
 
@@ -86,10 +303,10 @@ def add_assistant_message(conversation_id: str, stage1: List, stage2: List, stag
 def update_conversation_title(conversation_id: str, title: str):
     db = SessionLocal()
     try:
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if conversation:
-            conversation.title = title
-            db.commit()
+        if db.query(Conversation).filter(Conversation.id == conversation_id).update({"title": title}):
+            _notify_changed(db, conversation_id)
+        db.commit()
+        _cache.invalidate(conversation_id)
     finally:
         db.close()
 
@@ -100,6 +317,223 @@ def delete_conversation(conversation_id: str):
         conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
         if conversation:
             db.delete(conversation)
+            db.query(ConversationArchive).filter(ConversationArchive.conversation_id == conversation_id).delete()
+            _notify_changed(db, conversation_id)
             db.commit()
+            _cache.invalidate(conversation_id)
+    finally:
+        db.close()
+
+
+def _council_run_snapshot(db, key: str) -> Optional[Dict[str, Any]]:
+    run = db.query(CouncilRun).filter(CouncilRun.key == key).first()
+    if not run:
+        return None
+    followers = db.query(func.count()).select_from(CouncilRunFollower).filter(
+        CouncilRunFollower.key == key,
+        CouncilRunFollower.seen_at >= func.localtimestamp() - timedelta(seconds=SINGLE_FLIGHT_FOLLOWER_TTL),
+    ).scalar()
+    return {"key": run.key, "status": run.status, "events": run.events or [], "followers": followers, "updated_at": run.updated_at}
+
+
+def get_council_run(key: str) -> Optional[Dict[str, Any]]:
+    """A run's row, with `followers` counting the live callers tailing it from other workers."""
+    db = SessionLocal()
+    try:
+        return _council_run_snapshot(db, key)
+    finally:
+        db.close()
+
+
+def save_council_run(key: str, status: str, events: List[Dict[str, Any]]):
+    db = SessionLocal()
+    try:
+        run = db.query(CouncilRun).filter(CouncilRun.key == key).first()
+        if not run:
+            run = CouncilRun(key=key)
+            db.add(run)
+        run.status = status
+        run.events = list(events)
+        run.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def join_council_run(key: str, follower_id: str) -> Dict[str, Any]:
+    """Register a remote follower of a run and return the run's row as of joining."""
+    db = SessionLocal()
+    try:
+        db.add(CouncilRunFollower(key=key, follower_id=follower_id, seen_at=func.localtimestamp()))
+        if not db.query(CouncilRun).filter(CouncilRun.key == key).first():
+            # Joined before the leader wrote its row; "waiting" rows are never mistaken for a finished run.
+            db.add(CouncilRun(key=key, status="waiting", events=[], updated_at=datetime.utcnow()))
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            db.add(CouncilRunFollower(key=key, follower_id=follower_id, seen_at=func.localtimestamp()))
+            db.flush()
+        snapshot = _council_run_snapshot(db, key)
+        db.commit()
+        return snapshot
+    finally:
+        db.close()
+
+
+def touch_council_run_follower(key: str, follower_id: str):
+    db = SessionLocal()
+    try:
+        db.query(CouncilRunFollower).filter(CouncilRunFollower.key == key, CouncilRunFollower.follower_id == follower_id).update(
+            {"seen_at": func.localtimestamp()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def leave_council_run(key: str, follower_id: str) -> Optional[Dict[str, Any]]:
+    """Unregister a remote follower and return the run's row, counting the followers that remain."""
+    db = SessionLocal()
+    try:
+        db.query(CouncilRunFollower).filter(CouncilRunFollower.key == key, CouncilRunFollower.follower_id == follower_id).delete()
+        snapshot = _council_run_snapshot(db, key)
+        db.commit()
+        return snapshot
     finally:
         db.close()
+
+
+def prune_council_runs(older_than: datetime):
+    db = SessionLocal()
+    try:
+        db.query(CouncilRun).filter(CouncilRun.status != "running", CouncilRun.updated_at < older_than).delete()
+        db.query(CouncilRunFollower).filter(
+            CouncilRunFollower.seen_at < func.localtimestamp() - timedelta(seconds=SINGLE_FLIGHT_FOLLOWER_TTL)
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+_dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+
+
+def _load_dictionary(db, dictionary_id: Optional[int]) -> Optional[zstandard.ZstdCompressionDict]:
+    if dictionary_id is None:
+        return None
+    if dictionary_id not in _dictionaries:
+        row = db.query(ArchiveDictionary).filter(ArchiveDictionary.id == dictionary_id).first()
+        _dictionaries[dictionary_id] = zstandard.ZstdCompressionDict(row.data)
+    return _dictionaries[dictionary_id]
+
+
+def _train_dictionary(db, samples: List[bytes]) -> Optional[int]:
+    """Train and store a shared dictionary; returns None when there is too little text to train on."""
+    try:
+        trained = zstandard.train_dictionary(ARCHIVE_DICT_SIZE, samples)
+    except zstandard.ZstdError:
+        return None
+    row = ArchiveDictionary(data=trained.as_bytes(), created_at=datetime.utcnow())
+    db.add(row)
+    db.flush()
+    _dictionaries[row.id] = trained
+    return row.id
+
+
+def _decompress(db, archive: ConversationArchive) -> Dict[str, Any]:
+    dictionary = _load_dictionary(db, archive.dictionary_id)
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary) if dictionary else zstandard.ZstdDecompressor()
+    return json.loads(decompressor.decompress(archive.payload))
+
+
+def _rehydrate(db, conversation_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    archive = db.query(ConversationArchive).filter(ConversationArchive.conversation_id == conversation_id).first()
+    detail = _decompress(db, archive) if archive else {}
+    rehydrated = []
+    for index, msg in enumerate(messages):
+        if msg.get("archived"):
+            msg = {key: value for key, value in msg.items() if key != "archived"}
+            msg.update(detail.get(str(index), {"stage1": [], "stage2": []}))
+        rehydrated.append(msg)
+    return rehydrated
+
+
+def _compact_batch(db, batch: List[Conversation], report: Dict[str, int]):
+    dictionary_id = db.query(ArchiveDictionary.id).order_by(ArchiveDictionary.id.desc()).limit(1).scalar()
+    if dictionary_id is None:
+        samples = [
+            json.dumps({"stage1": msg.get("stage1"), "stage2": msg.get("stage2")}).encode()
+            for conv in batch for msg in conv.messages if msg.get("role") == "assistant"
+        ]
+        dictionary_id = _train_dictionary(db, samples)
+    dictionary = _load_dictionary(db, dictionary_id)
+    compressor = zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL, dict_data=dictionary) if dictionary else zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL)
+
+    for conv in batch:
+        archive = db.query(ConversationArchive).filter(ConversationArchive.conversation_id == conv.id).first()
+        detail = _decompress(db, archive) if archive else {}
+        hot_before = len(json.dumps(conv.messages).encode())
+        archive_before = len(archive.payload) if archive else 0
+
+        messages = []
+        for index, msg in enumerate(conv.messages):
+            if msg.get("role") == "assistant" and not msg.get("archived"):
+                detail[str(index)] = {"stage1": msg.get("stage1", []), "stage2": msg.get("stage2", [])}
+                msg = {key: value for key, value in msg.items() if key not in ("stage1", "stage2")}
+                msg["archived"] = True
+            messages.append(msg)
+
+        payload = compressor.compress(json.dumps(detail).encode())
+        if archive is None:
+            archive = ConversationArchive(conversation_id=conv.id)
+            db.add(archive)
+        archive.dictionary_id = dictionary_id
+        archive.payload = payload
+        archive.archived_at = datetime.utcnow()
+        conv.messages = messages
+        _notify_changed(db, conv.id)
+
+        hot_after = len(json.dumps(messages).encode())
+        report["conversations"] += 1
+        report["hot_bytes_before"] += hot_before
+        report["hot_bytes_after"] += hot_after
+        report["archive_bytes"] += len(payload) - archive_before
+
+
+def compact_conversations(older_than_days: int) -> Dict[str, int]:
+    """Move stage-1/2 detail of conversations created before the cutoff into the compressed archive tier.
+
+    Stage 3 stays in the hot `conversations` row. Conversations are compacted in batches of
+    ARCHIVE_BATCH_SIZE, each locked and committed on its own; rows another worker is already
+    compacting are skipped, and message writers wait on the row lock instead of being overwritten.
+    Returns counts and the bytes moved out of the hot table.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    report = {"conversations": 0, "hot_bytes_before": 0, "hot_bytes_after": 0, "archive_bytes": 0, "bytes_reclaimed": 0}
+    last_id = ""
+    while True:
+        db = SessionLocal()
+        try:
+            # Unarchived assistant messages are the only ones that still carry a "stage1" key.
+            batch = db.query(Conversation).filter(
+                Conversation.created_at < cutoff,
+                Conversation.id > last_id,
+                cast(Conversation.messages, Text).like('%"stage1":%'),
+            ).order_by(Conversation.id).limit(ARCHIVE_BATCH_SIZE).with_for_update(skip_locked=True).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            candidates = [
+                conv for conv in batch
+                if any(msg.get("role") == "assistant" and not msg.get("archived") for msg in conv.messages or [])
+            ]
+            archived_ids = [conv.id for conv in candidates]
+            if candidates:
+                _compact_batch(db, candidates, report)
+            db.commit()
+            for conversation_id in archived_ids:
+                _cache.invalidate(conversation_id)
+        finally:
+            db.close()
+    report["bytes_reclaimed"] = report["hot_bytes_before"] - report["hot_bytes_after"] - report["archive_bytes"]
+    return report
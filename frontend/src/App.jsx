@@ -133,9 +133,17 @@ function App() {
 
       await api.sendMessageStream(currentConversationId, content, (eventType, event) => {
         switch (eventType) {
+          case 'queued':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              messages[messages.length - 1].queuePosition = event.position;
+              return { ...prev, messages };
+            });
+            break;
           case 'stage1_start':
             setCurrentConversation((prev) => {
               const messages = [...prev.messages];
+              messages[messages.length - 1].queuePosition = null;
               messages[messages.length - 1].loading.stage1 = true;
               return { ...prev, messages };
             });
@@ -186,6 +194,16 @@ function App() {
             loadConversations();
             setIsLoading(false);
             break;
+          case 'cancelled':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              messages[messages.length - 1].queuePosition = null;
+              messages[messages.length - 1].loading = { stage1: false, stage2: false, stage3: false };
+              return { ...prev, messages };
+            });
+            loadConversations();
+            setIsLoading(false);
+            break;
           case 'error':
             console.error('Stream error:', event.message);
             setIsLoading(false);
@@ -202,6 +220,15 @@ function App() {
     }
   };
 
+  const handleStopMessage = async () => {
+    if (!currentConversationId) return;
+    try {
+      await api.cancelMessage(currentConversationId);
+    } catch (error) {
+      console.error('Failed to cancel message:', error);
+    }
+  };
+
   return (
     <div className={`app ${darkMode ? 'dark-mode' : 'light-mode'}`}>
       <Sidebar
@@ -218,6 +245,7 @@ function App() {
       <ChatInterface
         conversation={currentConversation}
         onSendMessage={handleSendMessage}
+        onStopMessage={handleStopMessage}
         isLoading={isLoading}
       />
     </div>
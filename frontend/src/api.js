@@ -45,12 +45,21 @@ export const api = {
     return response.text();
   },
 
+  async cancelMessage(conversationId) {
+    const response = await fetch(`${API_BASE}/api/conversations/${conversationId}/cancel`, { method: 'POST' });
+    if (!response.ok) throw new Error('Failed to cancel message');
+    return response.json();
+  },
+
   async sendMessageStream(conversationId, content, onEvent) {
     const response = await fetch(`${API_BASE}/api/conversations/${conversationId}/message/stream`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ content }),
     });
+    if (response.status === 429) {
+      throw new Error(`The Board Room is at capacity; retry in ${response.headers.get('Retry-After')}s`);
+    }
     if (!response.ok) throw new Error('Failed to send message');
 
     const reader = response.body.getReader();
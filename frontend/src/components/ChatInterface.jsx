@@ -5,7 +5,7 @@ import Stage2 from './Stage2';
 import Stage3 from './Stage3';
 import './ChatInterface.css';
 
-export default function ChatInterface({ conversation, onSendMessage, isLoading }) {
+export default function ChatInterface({ conversation, onSendMessage, onStopMessage, isLoading }) {
   const [input, setInput] = useState('');
   const messagesEndRef = useRef(null);
 
@@ -53,6 +53,7 @@ export default function ChatInterface({ conversation, onSendMessage, isLoading }
               ) : (
                 <div className="assistant-message">
                   <div className="message-label">The Board Room</div>
+                  {msg.queuePosition > 0 && <div className="stage-loading"><div className="spinner"></div><span>Waiting for a council seat - position {msg.queuePosition} in line...</span></div>}
                   {msg.loading?.stage1 && <div className="stage-loading"><div className="spinner"></div><span>Stage 1: Gathering Council Perspectives...</span></div>}
                   {msg.stage1 && <Stage1 responses={msg.stage1} />}
                   {msg.loading?.stage2 && <div className="stage-loading"><div className="spinner"></div><span>Stage 2: Peer Rankings...</span></div>}
@@ -78,9 +79,11 @@ export default function ChatInterface({ conversation, onSendMessage, isLoading }
             disabled={isLoading}
             rows={2}
           />
-          <button type="submit" className="send-button" disabled={!input.trim() || isLoading}>
-            {isLoading ? <div className="spinner"></div> : 'Send'}
-          </button>
+          {isLoading ? (
+            <button type="button" className="send-button stop-button" onClick={onStopMessage}>Stop</button>
+          ) : (
+            <button type="submit" className="send-button" disabled={!input.trim()}>Send</button>
+          )}
         </form>
       )}
     </div>
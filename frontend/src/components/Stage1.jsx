@@ -14,7 +14,7 @@ export default function Stage1({ responses }) {
         {responses.map((resp, index) => (
           <div key={index} className={`response-card ${expanded === index ? 'expanded' : ''}`}>
             <div className="response-header" onClick={() => setExpanded(expanded === index ? null : index)}>
-              <span className="model-name">{resp.model}</span>
+              <span className="model-name">{resp.fallback ? `${resp.model} (${resp.model_id})` : resp.model}</span>
               <span className="expand-btn">{expanded === index ? '−' : '+'}</span>
             </div>
             {expanded === index && (
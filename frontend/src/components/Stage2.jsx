@@ -35,7 +35,7 @@ export default function Stage2({ rankings, labelToModel, aggregateRankings }) {
         <div className="detailed-rankings">
           {rankings.map((ranking, i) => (
             <div key={i} className="ranking-card">
-              <div className="ranking-card-header">{ranking.model}'s Assessment</div>
+              <div className="ranking-card-header">{ranking.fallback ? `${ranking.model} (${ranking.model_id})` : ranking.model}'s Assessment</div>
               <div className="ranking-card-body">{ranking.ranking}</div>
             </div>
           ))}